@@ -8,6 +8,10 @@ from flask_limiter.util import get_remote_address
 from flask_mail import Mail
 from config import Config
 from app.utils.logger import setup_logger
+from app.utils.profiler import setup_profiler
+from app.utils.session_store import setup_session_store
+from app.utils.db_router import setup_db_router
+from app.utils.encryption import blind_index_key
 
 # Initialize extensions globally
 mysql = MySQL()
@@ -29,8 +33,15 @@ def create_app():
         # Aiven requires SSL. This tells flask-mysqldb to use it.
         app.config['MYSQL_CUSTOM_OPTIONS'] = {"ssl": {"ca": "/etc/ssl/certs/ca-certificates.crt"}}
 
+    # Fail at startup, not on the first write, if the keyring is mid-rotation
+    # without a stable blind index key
+    blind_index_key()
+
+    setup_session_store(app)
+
     # Initialize extensions
     mysql.init_app(app)
+    setup_db_router(app)
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
     csrf.init_app(app)
@@ -40,11 +51,17 @@ def create_app():
     # Register Blueprints
     from app.auth import auth_bp
     from app.prescriptions import prescriptions_bp
+    from app.admin import admin_bp
     app.register_blueprint(auth_bp)
     app.register_blueprint(prescriptions_bp)
+    app.register_blueprint(admin_bp)
 
     from app import models
     setup_logger(app)
+    setup_profiler(app)
+
+    from app.commands import register_commands
+    register_commands(app)
 
     @app.errorhandler(429)
     def too_many_requests(e):
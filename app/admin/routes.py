@@ -0,0 +1,38 @@
+from functools import wraps
+from flask import current_app, abort, jsonify, url_for, Response
+from flask_login import login_required, current_user
+from app.admin import admin_bp
+from app.utils import profiler
+
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if current_user.username not in current_app.config.get('ADMIN_USERNAMES', []):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+@admin_bp.route('/profiles')
+@admin_required
+def profiles():
+    directory = current_app.config['PROFILER_DIR']
+    return jsonify({
+        'enabled': current_app.config['PROFILER_ENABLED'],
+        'sample_rate': current_app.config['PROFILER_SAMPLE_RATE'],
+        'reports': [
+            {'name': name, 'url': url_for('admin.profile_report', name=name)}
+            for name in profiler.list_reports(directory)
+        ]
+    })
+
+
+@admin_bp.route('/profiles/<name>')
+@admin_required
+def profile_report(name):
+    report = profiler.read_report(current_app.config['PROFILER_DIR'], name)
+    if report is None:
+        abort(404)
+    return Response(report, mimetype='text/plain')
@@ -6,6 +6,7 @@ from app.auth import auth_bp
 from app.utils.hashing import hash_password, check_password
 from app.utils.audit import log_audit
 from app.models import User
+from app.utils.db_router import mark_write
 from app import mysql, limiter, mail
 import secrets
 import re
@@ -31,15 +32,18 @@ def login():
         if row and check_password(password, row[3]):
             user = User(id=row[0], username=row[1], email=row[2])
             login_user(user)
+            # A just-registered user may not have reached the replica yet
+            mark_write()
             session.permanent = True
             current_app.logger.info(
-                f"LOGIN SUCCESS | user_id={user.id} | username={user.username} | ip={request.remote_addr}"
+                "LOGIN SUCCESS | user_id=%s | username=%s | ip=%s",
+                user.id, user.username, request.remote_addr
             )
             log_audit('LOGIN_SUCCESS', 'User logged in', user_id=user.id, username=user.username)
             return redirect(url_for('prescriptions.dashboard'))
         else:
             current_app.logger.warning(
-                f"LOGIN FAILED | identifier={identifier} | ip={request.remote_addr}"
+                "LOGIN FAILED | identifier=%s | ip=%s", identifier, request.remote_addr
             )
             log_audit('LOGIN_FAILED', f'Failed login attempt for: {identifier}', user_id=None, username=identifier)
             flash('Invalid credentials.', 'danger')
@@ -83,14 +87,15 @@ def register():
             mysql.connection.commit()
             cur.close()
             current_app.logger.info(
-                f"REGISTER SUCCESS | username={username} | email={email} | ip={request.remote_addr}"
+                "REGISTER SUCCESS | username=%s | email=%s | ip=%s",
+                username, email, request.remote_addr
             )
             log_audit('REGISTER', f'New account created with email: {email}', username=username)
             flash('Account created! Please log in.', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
             current_app.logger.error(
-                f"REGISTER FAILED | username={username} | error={str(e)}"
+                "REGISTER FAILED | username=%s | error=%s", username, e
             )
             flash('Email or username already exists.', 'danger')
 
@@ -101,7 +106,7 @@ def register():
 @login_required
 def logout():
     current_app.logger.info(
-        f"LOGOUT | user_id={current_user.id} | username={current_user.username}"
+        "LOGOUT | user_id=%s | username=%s", current_user.id, current_user.username
     )
     log_audit('LOGOUT', 'User logged out')
     logout_user()
@@ -150,7 +155,7 @@ If you did not request this, please ignore this email.
 """
             mail.send(msg)
             current_app.logger.info(
-                f"PASSWORD RESET REQUESTED | user_id={user_id} | email={email}"
+                "PASSWORD RESET REQUESTED | user_id=%s | email=%s", user_id, email
             )
             log_audit('PASSWORD_RESET_REQUESTED', f'Reset requested for email: {email}', user_id=user_id)
 
@@ -218,7 +223,7 @@ def reset_password(token):
         mysql.connection.commit()
         cur.close()
 
-        current_app.logger.info(f"PASSWORD RESET SUCCESS | user_id={user_id}")
+        current_app.logger.info("PASSWORD RESET SUCCESS | user_id=%s", user_id)
         log_audit('PASSWORD_RESET_SUCCESS', 'Password was reset successfully', user_id=user_id)
         flash('Password reset successfully! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -229,18 +234,13 @@ def reset_password(token):
 
 @auth_bp.before_request
 def check_session_timeout():
-    if current_user.is_authenticated:
-        last_active = session.get('last_active')
-        now = datetime.now(timezone.utc).timestamp()
-
-        if last_active and (now - last_active) > 900:
-            current_app.logger.info(
-                f"SESSION TIMEOUT | user_id={current_user.id} | username={current_user.username}"
-            )
-            log_audit('SESSION_TIMEOUT', 'Session expired due to inactivity')
-            logout_user()
-            session.clear()
-            flash('Your session expired due to inactivity. Please log in again.', 'warning')
-            return redirect(url_for('auth.login'))
-
-        session['last_active'] = now
\ No newline at end of file
+    # The session store already refreshed last-active when it opened the
+    # session, and swapped in an empty one if the old one had been idle for
+    # longer than PERMANENT_SESSION_LIFETIME; all that is left is telling
+    # the user. No user load or session write happens on the normal path.
+    expired_user_id = getattr(session, 'expired_user_id', None)
+    if expired_user_id:
+        current_app.logger.info("SESSION TIMEOUT | user_id=%s", expired_user_id)
+        log_audit('SESSION_TIMEOUT', 'Session expired due to inactivity', user_id=expired_user_id)
+        flash('Your session expired due to inactivity. Please log in again.', 'warning')
+        return redirect(url_for('auth.login'))
\ No newline at end of file
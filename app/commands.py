@@ -0,0 +1,120 @@
+import os
+import click
+from app import mysql
+from app.utils import storage, stats, key_rotation
+from app.utils.encryption import primary_key_id
+
+
+def register_commands(app):
+
+    @app.cli.command('migrate-uploads')
+    @click.option('--batch-size', default=500, show_default=True,
+                  help='Files moved per batch.')
+    @click.option('--pause', default=0.1, show_default=True,
+                  help='Seconds to sleep between batches to limit I/O pressure.')
+    @click.option('--limit', default=None, type=int,
+                  help='Stop after moving this many files.')
+    def migrate_uploads(batch_size, pause, limit):
+        """Move flat uploads/<id>.enc files into the sharded layout."""
+        moved = storage.migrate_legacy_files(
+            app.config['UPLOAD_FOLDER'],
+            batch_size=batch_size,
+            pause=pause,
+            limit=limit,
+            logger=app.logger
+        )
+        click.echo(f"Moved {moved} file(s) into the sharded layout.")
+
+    @app.cli.command('sweep-uploads')
+    @click.option('--min-age', default=3600, show_default=True,
+                  help='Only consider files older than this many seconds.')
+    @click.option('--batch-size', default=500, show_default=True,
+                  help='Files checked against the database per query.')
+    @click.option('--dry-run', is_flag=True, help='List orphans without deleting them.')
+    def sweep_uploads(min_age, batch_size, dry_run):
+        """Delete stored files that no prescription refers to any more."""
+        cur = mysql.connection.cursor()
+        # The pre-multi-image image_path column may still point at files
+        cur.execute("SELECT image_path FROM prescriptions WHERE image_path IS NOT NULL AND image_path <> ''")
+        legacy = {os.path.basename(row[0]) for row in cur.fetchall()}
+
+        def referenced(names):
+            if not names:
+                return set()
+            placeholders = ', '.join(['%s'] * len(names))
+            cur.execute(
+                f"SELECT filename FROM prescription_images WHERE filename IN ({placeholders})",
+                names
+            )
+            found = {row[0] for row in cur.fetchall()}
+            # Fresh snapshot for the next batch
+            mysql.connection.commit()
+            return found | (legacy & set(names))
+
+        removed = storage.sweep_orphans(
+            app.config['UPLOAD_FOLDER'], referenced,
+            min_age=min_age, batch_size=batch_size, dry_run=dry_run, logger=app.logger
+        )
+        cur.close()
+        click.echo(f"{'Found' if dry_run else 'Removed'} {removed} orphaned file(s).")
+
+    @app.cli.command('sweep-sessions')
+    def sweep_sessions():
+        """Delete every expired server-side session."""
+        deleted = app.session_interface.store.sweep()
+        click.echo(f"Removed {deleted} expired session(s).")
+
+    @app.cli.command('rebuild-stats')
+    @click.option('--user-id', default=None, type=int,
+                  help='Only rebuild this user; defaults to every user.')
+    def rebuild_stats(user_id):
+        """Recompute dashboard statistics from the prescription history."""
+        cur = mysql.connection.cursor()
+        if user_id is None:
+            cur.execute("SELECT id FROM users ORDER BY id")
+            user_ids = [row[0] for row in cur.fetchall()]
+        else:
+            user_ids = [user_id]
+
+        for uid in user_ids:
+            count = stats.rebuild_user_stats(cur, uid, app.config['UPLOAD_FOLDER'])
+            mysql.connection.commit()
+            app.logger.info("STATS REBUILT | user_id=%s | prescriptions=%s", uid, count)
+        cur.close()
+        click.echo(f"Rebuilt statistics for {len(user_ids)} user(s).")
+
+    @app.cli.command('rotate-keys')
+    @click.option('--batch-size', default=200, show_default=True,
+                  help='Rows or files re-encrypted per transaction.')
+    @click.option('--pause', default=0.05, show_default=True,
+                  help='Seconds to sleep between batches to limit load.')
+    @click.option('--user-id', default=None, type=int,
+                  help='Only rotate this user\'s data.')
+    @click.option('--status', 'show_status', is_flag=True,
+                  help='Print checkpoint state and exit.')
+    def rotate_keys(batch_size, pause, user_id, show_status):
+        """Re-encrypt all fields and files under the primary key in FERNET_KEYS."""
+        if show_status:
+            for job in key_rotation.rotation_status(mysql.connection):
+                click.echo(
+                    f"{job['job']:<32} key={job['key_id']} last_id={job['last_id']} "
+                    f"processed={job['processed']} completed={job['completed']} "
+                    f"updated={job['updated_at']}"
+                )
+            return
+
+        def report(job, processed, remaining, rate, eta):
+            eta_text = f"{eta:.0f}s" if eta is not None else '?'
+            click.echo(f"{job}: {processed} done, {remaining} left, {rate:.1f}/s, ETA {eta_text}")
+            app.logger.info(
+                "KEY ROTATION | job=%s | processed=%s | remaining=%s | rate=%.1f/s | eta=%s",
+                job, processed, remaining, rate, eta_text
+            )
+
+        click.echo(f"Rotating to key {primary_key_id()}")
+        totals = key_rotation.rotate_all(
+            mysql.connection, app.config['UPLOAD_FOLDER'],
+            batch_size=batch_size, pause=pause, user_id=user_id, report=report
+        )
+        for job, processed in totals.items():
+            click.echo(f"{job}: complete ({processed} total)")
@@ -1,5 +1,15 @@
 from app import mysql
 
+def add_column_if_missing(cur, table, column, definition):
+    cur.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
 def init_db(app):
     with app.app_context():
         try:
@@ -24,10 +34,14 @@ def init_db(app):
                     dosage BLOB NOT NULL,
                     notes BLOB,
                     image_path VARCHAR(255),
+                    archived TINYINT(1) NOT NULL DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 )
             """)
+            # Tables created before archiving existed
+            add_column_if_missing(cur, 'prescriptions', 'archived',
+                                  "TINYINT(1) NOT NULL DEFAULT 0 AFTER image_path")
 
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS prescription_images (
@@ -65,10 +79,56 @@ def init_db(app):
                 )
             """)
 
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    user_id INT PRIMARY KEY,
+                    prescription_count INT UNSIGNED NOT NULL DEFAULT 0,
+                    image_count INT UNSIGNED NOT NULL DEFAULT 0,
+                    storage_bytes BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """)
+
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_monthly_stats (
+                    user_id INT NOT NULL,
+                    month CHAR(7) NOT NULL,
+                    prescription_count INT UNSIGNED NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, month),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """)
+
+            # med_index is a blind index (HMAC) of the medication name;
+            # med_name holds the Fernet-encrypted display name
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_medication_stats (
+                    user_id INT NOT NULL,
+                    med_index CHAR(64) NOT NULL,
+                    med_name BLOB NOT NULL,
+                    prescription_count INT UNSIGNED NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, med_index),
+                    INDEX idx_user_count (user_id, prescription_count),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """)
+
+            # Checkpoints for the resumable key rotation jobs
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS key_rotation_state (
+                    job VARCHAR(64) PRIMARY KEY,
+                    key_id CHAR(16) NOT NULL,
+                    last_id BIGINT NOT NULL DEFAULT 0,
+                    processed BIGINT NOT NULL DEFAULT 0,
+                    completed TINYINT(1) NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
+            """)
+
             mysql.connection.commit()
             cur.close()
             app.logger.info("DB INIT SUCCESS | All tables created or already exist")
 
         except Exception as e:
-            app.logger.error(f"DB INIT FAILED | {str(e)}")
+            app.logger.error("DB INIT FAILED | %s", e)
             
\ No newline at end of file
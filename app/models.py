@@ -1,5 +1,6 @@
 from flask_login import UserMixin
-from app import mysql, login_manager
+from app import login_manager
+from app.utils.db_router import read_db
 
 class User(UserMixin):
     def __init__(self, id, username, email):
@@ -9,7 +10,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    cur = mysql.connection.cursor()
+    cur = read_db().cursor()
     cur.execute("SELECT id, username, email FROM users WHERE id = %s", (user_id,))
     row = cur.fetchone()
     cur.close()
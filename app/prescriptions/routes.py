@@ -1,12 +1,15 @@
-import os
-import uuid
-from flask import render_template, request, redirect, url_for, flash, current_app, send_file, abort, jsonify, session
+from flask import render_template, stream_template, request, redirect, url_for, flash, current_app, send_file, abort, jsonify, session, get_flashed_messages
 from flask_login import login_required, current_user
+from flask_wtf.csrf import generate_csrf
 from app.prescriptions import prescriptions_bp
 from app.utils.encryption import encrypt, decrypt, encrypt_file, decrypt_file
 from app.utils.audit import log_audit
+from app.utils import storage, stats
+from app.utils.session_store import touch_session
+from app.utils.db_router import read_db, mark_write
 from app import mysql
-from datetime import datetime, timezone
+from datetime import datetime
+from MySQLdb.cursors import SSCursor
 import io
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
@@ -16,24 +19,36 @@ def allowed_file(filename):
 
 
 def save_encrypted_file(file, upload_folder):
-    """Encrypt and save a file, return stored filename and extension."""
+    """Encrypt and save a file, return stored filename, extension and stored size."""
     ext = file.filename.rsplit('.', 1)[1].lower()
-    filename = f"{uuid.uuid4().hex}.enc"
-    os.makedirs(upload_folder, exist_ok=True)
+    filename = storage.new_filename()
     encrypted_bytes = encrypt_file(file.read())
-    with open(os.path.join(upload_folder, filename), 'wb') as f:
-        f.write(encrypted_bytes)
-    return filename, ext
+    storage.write_file(upload_folder, filename, encrypted_bytes)
+    return filename, ext, len(encrypted_bytes)
 
 
 @prescriptions_bp.route('/dashboard')
 @login_required
 def dashboard():
-    cur = mysql.connection.cursor()
+    show_archived = request.args.get('archived') == '1'
+    streaming = request.args.get('stream', '1' if current_app.config['DASHBOARD_STREAMING'] else '0') == '1'
+    if streaming:
+        # The session cookie is written before the body streams, so anything
+        # the template would store in the session (consumed flashes, the CSRF
+        # token) has to happen here
+        get_flashed_messages(with_categories=True)
+        generate_csrf()
+        return current_app.response_class(stream_template(
+            'dashboard.html',
+            prescriptions=iter_dashboard_prescriptions(current_user.id, show_archived),
+            show_archived=show_archived
+        ))
+
+    cur = read_db().cursor()
     cur.execute(
         "SELECT id, patient_name, medication, dosage, notes, image_path, created_at "
-        "FROM prescriptions WHERE user_id = %s ORDER BY created_at DESC",
-        (current_user.id,)
+        "FROM prescriptions WHERE user_id = %s AND archived = %s ORDER BY created_at DESC",
+        (current_user.id, int(show_archived))
     )
     rows = cur.fetchall()
 
@@ -59,7 +74,53 @@ def dashboard():
         })
 
     cur.close()
-    return render_template('dashboard.html', prescriptions=prescriptions)
+    return render_template('dashboard.html', prescriptions=prescriptions, show_archived=show_archived)
+
+
+def iter_dashboard_prescriptions(user_id, show_archived, batch_size=100):
+    """Yield decrypted prescriptions one at a time for the streamed dashboard.
+
+    Image metadata for the whole page is fetched up front in one query; the
+    prescriptions themselves come from a server-side cursor, so neither the
+    raw rows nor the decrypted dicts are ever all held in memory.
+    """
+    cur = read_db().cursor()
+    cur.execute(
+        "SELECT pi.prescription_id, pi.id, pi.original_ext FROM prescription_images pi "
+        "JOIN prescriptions p ON pi.prescription_id = p.id "
+        "WHERE p.user_id = %s AND p.archived = %s",
+        (user_id, int(show_archived))
+    )
+    images = {}
+    for prescription_id, image_id, ext in cur.fetchall():
+        images.setdefault(prescription_id, []).append({'id': image_id, 'ext': ext})
+    cur.close()
+
+    cur = read_db().cursor(SSCursor)
+    try:
+        cur.execute(
+            "SELECT id, patient_name, medication, dosage, notes, image_path, created_at "
+            "FROM prescriptions WHERE user_id = %s AND archived = %s ORDER BY created_at DESC",
+            (user_id, int(show_archived))
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield {
+                    'id': row[0],
+                    'patient_name': decrypt(row[1]),
+                    'medication': decrypt(row[2]),
+                    'dosage': decrypt(row[3]),
+                    'notes': decrypt(row[4]) if row[4] else '',
+                    'image_path': row[5],  # legacy single image
+                    'images': images.pop(row[0], []),
+                    'created_at': row[6]
+                }
+    finally:
+        # Also reached if the client disconnects mid-stream
+        cur.close()
 
 
 @prescriptions_bp.route('/add', methods=['GET', 'POST'])
@@ -79,36 +140,48 @@ def add_prescription():
 
         try:
             cur = mysql.connection.cursor()
+            upload_folder = current_app.config['UPLOAD_FOLDER']
+            stats.lock_user_stats(cur, current_user.id, upload_folder)
             cur.execute(
                 "INSERT INTO prescriptions (user_id, patient_name, medication, dosage, notes) "
                 "VALUES (%s, %s, %s, %s, %s)",
                 (current_user.id, enc_patient, enc_medication, enc_dosage, enc_notes)
             )
-            mysql.connection.commit()
             prescription_id = cur.lastrowid
 
             # Save each uploaded image
-            upload_folder = current_app.config['UPLOAD_FOLDER']
+            image_count = 0
+            image_bytes = 0
             for image_file in image_files:
                 if image_file and allowed_file(image_file.filename):
-                    filename, ext = save_encrypted_file(image_file, upload_folder)
+                    filename, ext, size = save_encrypted_file(image_file, upload_folder)
                     cur.execute(
                         "INSERT INTO prescription_images (prescription_id, filename, original_ext) "
                         "VALUES (%s, %s, %s)",
                         (prescription_id, filename, ext)
                     )
+                    image_count += 1
+                    image_bytes += size
+
+            cur.execute("SELECT created_at FROM prescriptions WHERE id = %s", (prescription_id,))
+            stats.record_prescription_added(
+                cur, current_user.id, medication,
+                image_count=image_count, image_bytes=image_bytes, created_at=cur.fetchone()[0]
+            )
             mysql.connection.commit()
+            mark_write()
             cur.close()
 
             current_app.logger.info(
-                f"PRESCRIPTION ADDED | user_id={current_user.id} | patient={patient_name}"
+                "PRESCRIPTION ADDED | user_id=%s | patient=%s", current_user.id, patient_name
             )
             log_audit('PRESCRIPTION_ADDED', f'Added prescription for patient: {patient_name}')
             flash('Prescription saved securely!', 'success')
             return redirect(url_for('prescriptions.dashboard'))
         except Exception as e:
+            mysql.connection.rollback()
             current_app.logger.error(
-                f"PRESCRIPTION ADD FAILED | user_id={current_user.id} | error={str(e)}"
+                "PRESCRIPTION ADD FAILED | user_id=%s | error=%s", current_user.id, e
             )
             flash(f'Error saving prescription: {str(e)}', 'danger')
 
@@ -155,29 +228,48 @@ def edit_prescription(prescription_id):
         image_files = request.files.getlist('images')
         remove_image_ids = request.form.getlist('remove_image')
 
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        image_delta = 0
+        bytes_delta = 0
+
+        # Re-read the old medication under the stats lock: the copy above
+        # may be stale if another edit committed in between
+        stats.lock_user_stats(cur, current_user.id, upload_folder)
+        cur.execute(
+            "SELECT medication FROM prescriptions WHERE id = %s AND user_id = %s FOR UPDATE",
+            (prescription_id, current_user.id)
+        )
+        locked = cur.fetchone()
+        if not locked:
+            mysql.connection.rollback()
+            flash('Prescription not found.', 'danger')
+            return redirect(url_for('prescriptions.dashboard'))
+        old_medication = decrypt(locked[0])
+
         # Remove selected images
         for img_id in remove_image_ids:
             cur.execute(
-                "SELECT filename FROM prescription_images WHERE id = %s AND prescription_id = %s",
+                "SELECT filename FROM prescription_images WHERE id = %s AND prescription_id = %s FOR UPDATE",
                 (img_id, prescription_id)
             )
             img_row = cur.fetchone()
             if img_row:
-                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], img_row[0])
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+                bytes_delta -= storage.file_size(upload_folder, img_row[0])
+                image_delta -= 1
+                storage.remove_file(upload_folder, img_row[0])
                 cur.execute("DELETE FROM prescription_images WHERE id = %s", (img_id,))
 
         # Add new images
-        upload_folder = current_app.config['UPLOAD_FOLDER']
         for image_file in image_files:
             if image_file and allowed_file(image_file.filename):
-                filename, ext = save_encrypted_file(image_file, upload_folder)
+                filename, ext, size = save_encrypted_file(image_file, upload_folder)
                 cur.execute(
                     "INSERT INTO prescription_images (prescription_id, filename, original_ext) "
                     "VALUES (%s, %s, %s)",
                     (prescription_id, filename, ext)
                 )
+                image_delta += 1
+                bytes_delta += size
 
         enc_patient = encrypt(patient_name)
         enc_medication = encrypt(medication)
@@ -191,12 +283,16 @@ def edit_prescription(prescription_id):
                 (enc_patient, enc_medication, enc_dosage, enc_notes,
                  prescription_id, current_user.id)
             )
+            stats.record_medication_changed(cur, current_user.id, old_medication, medication)
+            stats.record_images_changed(cur, current_user.id, image_delta, bytes_delta)
             mysql.connection.commit()
+            mark_write()
             cur.close()
             log_audit('PRESCRIPTION_UPDATED', f'Updated prescription ID: {prescription_id}')
             flash('Prescription updated successfully!', 'success')
             return redirect(url_for('prescriptions.dashboard'))
         except Exception as e:
+            mysql.connection.rollback()
             flash(f'Error updating prescription: {str(e)}', 'danger')
 
     return render_template('edit_prescription.html', prescription=prescription)
@@ -205,7 +301,7 @@ def edit_prescription(prescription_id):
 @prescriptions_bp.route('/image/<int:image_id>')
 @login_required
 def serve_image(image_id):
-    cur = mysql.connection.cursor()
+    cur = read_db().cursor()
     # Verify image belongs to current user via join
     cur.execute(
         "SELECT pi.filename, pi.original_ext FROM prescription_images pi "
@@ -219,13 +315,10 @@ def serve_image(image_id):
     if not row:
         abort(404)
 
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], row[0])
-    if not os.path.exists(filepath):
+    encrypted_bytes = storage.read_file(current_app.config['UPLOAD_FOLDER'], row[0])
+    if encrypted_bytes is None:
         abort(404)
 
-    with open(filepath, 'rb') as f:
-        encrypted_bytes = f.read()
-
     decrypted_bytes = decrypt_file(encrypted_bytes)
 
     mime_types = {
@@ -246,8 +339,10 @@ def serve_image(image_id):
 @login_required
 def delete_prescription(prescription_id):
     cur = mysql.connection.cursor()
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    stats.lock_user_stats(cur, current_user.id, upload_folder)
     cur.execute(
-        "SELECT image_path FROM prescriptions WHERE id = %s AND user_id = %s",
+        "SELECT medication, created_at FROM prescriptions WHERE id = %s AND user_id = %s FOR UPDATE",
         (prescription_id, current_user.id)
     )
     row = cur.fetchone()
@@ -255,18 +350,23 @@ def delete_prescription(prescription_id):
     if row:
         # Delete all images from prescription_images table
         cur.execute(
-            "SELECT filename FROM prescription_images WHERE prescription_id = %s",
+            "SELECT filename FROM prescription_images WHERE prescription_id = %s FOR UPDATE",
             (prescription_id,)
         )
         images = cur.fetchall()
+        image_bytes = 0
         for img in images:
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], img[0])
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            image_bytes += storage.file_size(upload_folder, img[0])
+            storage.remove_file(upload_folder, img[0])
 
         cur.execute("DELETE FROM prescriptions WHERE id = %s AND user_id = %s",
                     (prescription_id, current_user.id))
+        stats.record_prescription_removed(
+            cur, current_user.id, decrypt(row[0]), row[1],
+            image_count=len(images), image_bytes=image_bytes
+        )
         mysql.connection.commit()
+        mark_write()
         log_audit('PRESCRIPTION_DELETED', f'Deleted prescription ID: {prescription_id}')
         flash('Prescription deleted.', 'success')
     else:
@@ -277,18 +377,144 @@ def delete_prescription(prescription_id):
     return redirect(url_for('prescriptions.dashboard'))
 
 
+MAX_BULK_IDS = 500
+
+
+def parse_bulk_ids():
+    """Read a list of prescription IDs from a JSON body or repeated form field."""
+    payload = request.get_json(silent=True)
+    raw = payload.get('ids', []) if isinstance(payload, dict) else request.form.getlist('ids')
+    ids = []
+    for value in raw:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))[:MAX_BULK_IDS]
+
+
+def parse_flag(value):
+    """Strict boolean for JSON or form input; None if it is neither."""
+    if isinstance(value, bool):
+        return value
+    if value in (1, '1', 'true'):
+        return True
+    if value in (0, '0', 'false'):
+        return False
+    return None
+
+
+def fetch_owned(cur, ids, columns, for_update=False):
+    """Return rows for the IDs that belong to the current user, in one query."""
+    placeholders = ', '.join(['%s'] * len(ids))
+    cur.execute(
+        f"SELECT {columns} FROM prescriptions "
+        f"WHERE user_id = %s AND id IN ({placeholders})" + (" FOR UPDATE" if for_update else ""),
+        (current_user.id, *ids)
+    )
+    return cur.fetchall()
+
+
+@prescriptions_bp.route('/bulk/delete', methods=['POST'])
+@login_required
+def bulk_delete():
+    ids = parse_bulk_ids()
+    if not ids:
+        return jsonify({'error': 'No prescriptions selected.'}), 400
+
+    cur = mysql.connection.cursor()
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        stats.lock_user_stats(cur, current_user.id, upload_folder)
+        rows = fetch_owned(cur, ids, 'id, medication, created_at', for_update=True)
+        owned_ids = [row[0] for row in rows]
+        filenames = []
+        image_bytes = 0
+        if owned_ids:
+            placeholders = ', '.join(['%s'] * len(owned_ids))
+            cur.execute(
+                f"SELECT filename FROM prescription_images WHERE prescription_id IN ({placeholders}) FOR UPDATE",
+                owned_ids
+            )
+            filenames = [img[0] for img in cur.fetchall()]
+            image_bytes = sum(storage.file_size(upload_folder, name) for name in filenames)
+
+            cur.execute(
+                f"DELETE FROM prescriptions WHERE user_id = %s AND id IN ({placeholders})",
+                (current_user.id, *owned_ids)
+            )
+            stats.record_prescriptions_removed(
+                cur, current_user.id, [(decrypt(row[1]), row[2]) for row in rows],
+                image_count=len(filenames), image_bytes=image_bytes
+            )
+        mysql.connection.commit()
+        mark_write()
+    except Exception as e:
+        mysql.connection.rollback()
+        cur.close()
+        current_app.logger.error("BULK DELETE FAILED | user_id=%s | error=%s", current_user.id, e)
+        return jsonify({'error': 'Could not delete the selected prescriptions.'}), 500
+    cur.close()
+
+    # Rows are gone for good; the files can go at the worker's pace
+    storage.remove_files_later(upload_folder, filenames)
+
+    skipped = len(ids) - len(owned_ids)
+    log_audit('PRESCRIPTIONS_BULK_DELETED',
+              f'Deleted {len(owned_ids)} prescription(s), {skipped} not found: '
+              f'{", ".join(map(str, owned_ids))}')
+    return jsonify({'deleted': owned_ids, 'skipped': skipped})
+
+
+@prescriptions_bp.route('/bulk/archive', methods=['POST'])
+@login_required
+def bulk_archive():
+    payload = request.get_json(silent=True)
+    raw = payload.get('archive', True) if isinstance(payload, dict) else request.form.get('archive', '1')
+    archive = parse_flag(raw)
+    if archive is None:
+        return jsonify({'error': 'archive must be true or false.'}), 400
+    ids = parse_bulk_ids()
+    if not ids:
+        return jsonify({'error': 'No prescriptions selected.'}), 400
+
+    cur = mysql.connection.cursor()
+    try:
+        owned_ids = [row[0] for row in fetch_owned(cur, ids, 'id')]
+        if owned_ids:
+            placeholders = ', '.join(['%s'] * len(owned_ids))
+            cur.execute(
+                f"UPDATE prescriptions SET archived = %s WHERE user_id = %s AND id IN ({placeholders})",
+                (int(archive), current_user.id, *owned_ids)
+            )
+        mysql.connection.commit()
+        mark_write()
+    except Exception as e:
+        mysql.connection.rollback()
+        cur.close()
+        current_app.logger.error("BULK ARCHIVE FAILED | user_id=%s | error=%s", current_user.id, e)
+        return jsonify({'error': 'Could not update the selected prescriptions.'}), 500
+    cur.close()
+
+    action = 'PRESCRIPTIONS_BULK_ARCHIVED' if archive else 'PRESCRIPTIONS_BULK_UNARCHIVED'
+    log_audit(action, f'{"Archived" if archive else "Unarchived"} {len(owned_ids)} prescription(s): '
+                      f'{", ".join(map(str, owned_ids))}')
+    return jsonify({'updated': owned_ids, 'skipped': len(ids) - len(owned_ids)})
+
+
 @prescriptions_bp.route('/search')
 @login_required
 def search():
     query = request.args.get('q', '').strip().lower()
     date_from = request.args.get('date_from', '').strip()
     date_to = request.args.get('date_to', '').strip()
+    show_archived = request.args.get('archived') == '1'
 
-    cur = mysql.connection.cursor()
+    cur = read_db().cursor()
     cur.execute(
         "SELECT id, patient_name, medication, dosage, notes, created_at "
-        "FROM prescriptions WHERE user_id = %s",
-        (current_user.id,)
+        "FROM prescriptions WHERE user_id = %s AND archived = %s",
+        (current_user.id, int(show_archived))
     )
     rows = cur.fetchall()
 
@@ -342,8 +568,28 @@ def search():
     return jsonify(results)
 
 
-@prescriptions_bp.route('/ping')
+@prescriptions_bp.route('/stats')
 @login_required
+def user_stats():
+    cur = read_db().cursor()
+    result = stats.get_user_stats(cur, current_user.id)
+    cur.close()
+    if result is None:
+        # No counters yet (account predates them, or they were dropped after
+        # drift): build them once on the primary
+        cur = mysql.connection.cursor()
+        stats.lock_user_stats(cur, current_user.id, current_app.config['UPLOAD_FOLDER'])
+        mysql.connection.commit()
+        result = stats.get_user_stats(cur, current_user.id)
+        cur.close()
+    return jsonify(result)
+
+
+@prescriptions_bp.route('/ping')
 def ping():
-    session['last_active'] = datetime.now(timezone.utc).timestamp()
+    # Deliberately not @login_required: checking the session is enough, and
+    # avoids a users query on every keep-alive from every open tab
+    if not session.get('_user_id'):
+        return jsonify({'status': 'expired'}), 401
+    touch_session()
     return jsonify({'status': 'ok'})
\ No newline at end of file
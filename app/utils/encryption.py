@@ -1,11 +1,49 @@
+import hashlib
+import hmac
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 
-def get_fernet():
-    key = os.getenv("FERNET_KEY")
-    if not key:
+# Optional callback(kind, size) for decrypt calls; set only by the profiler
+_decrypt_observer = None
+
+
+def set_decrypt_observer(observer):
+    global _decrypt_observer
+    _decrypt_observer = observer
+
+_keyring_cache = {}
+
+
+def load_keys() -> list:
+    """Return the configured Fernet keys, primary (newest) first.
+
+    FERNET_KEYS holds a comma-separated keyring for rotation; a deployment
+    with a single key can keep using FERNET_KEY.
+    """
+    raw = os.getenv("FERNET_KEYS") or os.getenv("FERNET_KEY")
+    if not raw:
         raise ValueError("FERNET_KEY not set in environment variables")
-    return Fernet(key.encode())
+    return [k.strip() for k in raw.split(',') if k.strip()]
+
+
+def key_id(key: str) -> str:
+    """Short, non-secret identifier for a key, safe to log and store."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def primary_key_id() -> str:
+    return key_id(load_keys()[0])
+
+
+def get_fernet():
+    # Encrypts with the first key, decrypts with any of them
+    keys = tuple(load_keys())
+    fernet = _keyring_cache.get(keys)
+    if fernet is None:
+        fernet = MultiFernet([Fernet(k.encode()) for k in keys])
+        _keyring_cache.clear()
+        _keyring_cache[keys] = fernet
+    return fernet
 
 def encrypt(data: str) -> bytes:
     if not data:
@@ -15,10 +53,54 @@ def encrypt(data: str) -> bytes:
 def decrypt(token: bytes) -> str:
     if not token:
         return None
+    if _decrypt_observer:
+        _decrypt_observer('decrypt', len(token))
     return get_fernet().decrypt(token).decode('utf-8')
 
 def encrypt_file(file_bytes: bytes) -> bytes:
     return get_fernet().encrypt(file_bytes)
 
 def decrypt_file(encrypted_bytes: bytes) -> bytes:
-    return get_fernet().decrypt(encrypted_bytes)
\ No newline at end of file
+    if _decrypt_observer:
+        _decrypt_observer('decrypt_file', len(encrypted_bytes))
+    return get_fernet().decrypt(encrypted_bytes)
+
+def rotate_token(token: bytes) -> bytes:
+    """Re-encrypt a field or file token under the primary key."""
+    if not token:
+        return token
+    return get_fernet().rotate(token)
+
+
+def blind_index_key() -> str:
+    """Secret for blind indexes, kept separate from the rotating Fernet keys.
+
+    A single-key deployment may fall back to its FERNET_KEY. Once the ring
+    holds several keys one of them is being retired, so BLIND_INDEX_KEY is
+    required rather than deriving indexes from a key that is going away.
+    """
+    key = os.getenv("BLIND_INDEX_KEY")
+    if key:
+        return key
+    keys = load_keys()
+    if len(keys) > 1:
+        raise ValueError("BLIND_INDEX_KEY must be set when FERNET_KEYS holds more than one key")
+    return keys[0]
+
+
+def blind_index_key_id() -> str:
+    return key_id(blind_index_key())
+
+
+def blind_index(value: str) -> str:
+    """Deterministic keyed hash of a normalised value, for equality lookups.
+
+    Lets counters be grouped by a plaintext value (e.g. medication name)
+    without storing it in the clear. The HMAC key comes from
+    blind_index_key(); the rotate-keys job re-indexes existing counters
+    when it changes.
+    """
+    key = blind_index_key()
+    normalised = ' '.join(value.split()).casefold()
+    derived = hmac.new(key.encode(), b'carecrypt-blind-index', hashlib.sha256).digest()
+    return hmac.new(derived, normalised.encode('utf-8'), hashlib.sha256).hexdigest()
@@ -0,0 +1,217 @@
+import time
+from app.utils.encryption import (
+    rotate_token, decrypt, blind_index, key_id, primary_key_id, blind_index_key_id
+)
+from app.utils import storage
+
+# Online re-encryption of every field and file under the primary key.
+#
+# Each job walks its table in primary-key order, a batch at a time. A batch
+# locks its rows (SELECT ... FOR UPDATE), rewrites them, and stores the last
+# processed id in key_rotation_state in the same transaction, so a crash
+# loses at most one uncommitted batch and a re-run resumes from the
+# checkpoint. Reads keep working throughout because the keyring decrypts
+# with both the old and the new keys. Medication counters are also
+# re-keyed under the current BLIND_INDEX_KEY.
+
+PRESCRIPTION_FIELDS = ('patient_name', 'medication', 'dosage', 'notes')
+
+
+def _job_name(job, user_id):
+    return job if user_id is None else f"{job}:user={user_id}"
+
+
+def _load_checkpoint(cur, name, target_key):
+    cur.execute(
+        "SELECT key_id, last_id, processed, completed FROM key_rotation_state WHERE job = %s",
+        (name,)
+    )
+    row = cur.fetchone()
+    if row and row[0] == target_key:
+        return row[1], row[2], bool(row[3])
+    # New target key (or first run): start over
+    cur.execute(
+        "REPLACE INTO key_rotation_state (job, key_id, last_id, processed, completed) "
+        "VALUES (%s, %s, 0, 0, 0)",
+        (name, target_key)
+    )
+    return 0, 0, False
+
+
+def _save_checkpoint(cur, name, last_id, processed, completed=False):
+    cur.execute(
+        "UPDATE key_rotation_state SET last_id = %s, processed = %s, completed = %s "
+        "WHERE job = %s",
+        (last_id, processed, int(completed), name)
+    )
+
+
+def _rotate_prescriptions(cur, rows, upload_folder):
+    for row in rows:
+        cur.execute(
+            "UPDATE prescriptions SET patient_name = %s, medication = %s, dosage = %s, notes = %s "
+            "WHERE id = %s",
+            (*[rotate_token(value) for value in row[1:]], row[0])
+        )
+
+
+def _rotate_images(cur, rows, upload_folder):
+    for image_id, filename in rows:
+        encrypted_bytes = storage.read_file(upload_folder, filename)
+        if encrypted_bytes is None:
+            continue
+        storage.replace_file(upload_folder, filename, rotate_token(encrypted_bytes))
+
+
+def _rotate_medication_stats(cur, rows, upload_folder):
+    for user_id, med_index, med_name, count in rows:
+        new_index = blind_index(decrypt(med_name))
+        if new_index == med_index:
+            cur.execute(
+                "UPDATE user_medication_stats SET med_name = %s WHERE user_id = %s AND med_index = %s",
+                (rotate_token(med_name), user_id, med_index)
+            )
+            continue
+        # Indexed under an older blind index key: move the count, merging
+        # into any counter already created under the current key
+        cur.execute(
+            "DELETE FROM user_medication_stats WHERE user_id = %s AND med_index = %s",
+            (user_id, med_index)
+        )
+        cur.execute(
+            "INSERT INTO user_medication_stats (user_id, med_index, med_name, prescription_count) "
+            "VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE prescription_count = prescription_count + VALUES(prescription_count)",
+            (user_id, new_index, rotate_token(med_name), count)
+        )
+
+
+# job name -> (count SQL, batch SQL, rotate function). Batch queries return
+# the checkpoint id first; {scope} narrows to one user when requested.
+JOBS = {
+    'prescriptions': (
+        "SELECT COUNT(*) FROM prescriptions WHERE id > %s{scope}",
+        "SELECT id, " + ", ".join(PRESCRIPTION_FIELDS) + " FROM prescriptions "
+        "WHERE id > %s{scope} ORDER BY id LIMIT %s FOR UPDATE",
+        _rotate_prescriptions,
+        " AND user_id = %s",
+    ),
+    'images': (
+        "SELECT COUNT(*) FROM prescription_images pi "
+        "JOIN prescriptions p ON pi.prescription_id = p.id WHERE pi.id > %s{scope}",
+        "SELECT pi.id, pi.filename FROM prescription_images pi "
+        "JOIN prescriptions p ON pi.prescription_id = p.id "
+        # Lock only the image rows: files are re-encrypted while the batch
+        # is held, and edits to the prescriptions themselves must not wait
+        "WHERE pi.id > %s{scope} ORDER BY pi.id LIMIT %s FOR UPDATE OF pi",
+        _rotate_images,
+        " AND p.user_id = %s",
+    ),
+    # Counters are keyed per user, so the checkpoint is the user id and a
+    # batch covers every counter of the users it includes
+    'medication_stats': (
+        "SELECT COUNT(*) FROM user_medication_stats WHERE user_id > %s{scope}",
+        "SELECT user_id, med_index, med_name, prescription_count FROM user_medication_stats "
+        "WHERE user_id > %s{scope} AND user_id <= ("
+        "  SELECT COALESCE(MAX(user_id), 0) FROM ("
+        "    SELECT DISTINCT user_id FROM user_medication_stats "
+        "    WHERE user_id > %s{scope} ORDER BY user_id LIMIT %s"
+        "  ) AS batch_users"
+        ") ORDER BY user_id FOR UPDATE",
+        _rotate_medication_stats,
+        " AND user_id = %s",
+    ),
+}
+
+
+def _target_key(job):
+    # Counters are keyed by the blind index, so a new BLIND_INDEX_KEY
+    # re-runs that job even if the primary Fernet key is unchanged
+    if job == 'medication_stats':
+        return key_id(f"{primary_key_id()}:{blind_index_key_id()}")
+    return primary_key_id()
+
+
+def _batch_params(job, last_id, batch_size, user_id):
+    scope = () if user_id is None else (user_id,)
+    if job == 'medication_stats':
+        return (last_id, *scope, last_id, *scope, batch_size)
+    return (last_id, *scope, batch_size)
+
+
+def run_job(connection, job, upload_folder, batch_size=200, pause=0.0, user_id=None, report=None):
+    """Rotate one job to completion, resuming from its checkpoint.
+
+    ``report(job, processed, remaining, rate, eta)`` is called after every
+    batch; rate is rows (or files) per second, eta in seconds.
+    """
+    count_sql, batch_sql, rotate, scope_sql = JOBS[job]
+    scope = scope_sql if user_id is not None else ''
+    count_sql = count_sql.format(scope=scope)
+    batch_sql = batch_sql.format(scope=scope)
+    name = _job_name(job, user_id)
+    target_key = _target_key(job)
+
+    cur = connection.cursor()
+    last_id, processed, completed = _load_checkpoint(cur, name, target_key)
+    connection.commit()
+    if completed:
+        cur.close()
+        return processed
+
+    cur.execute(count_sql, (last_id,) if user_id is None else (last_id, user_id))
+    remaining = cur.fetchone()[0]
+    connection.commit()
+
+    started = time.perf_counter()
+    done_this_run = 0
+    while True:
+        cur.execute(batch_sql, _batch_params(job, last_id, batch_size, user_id))
+        rows = cur.fetchall()
+        if not rows:
+            _save_checkpoint(cur, name, last_id, processed, completed=True)
+            connection.commit()
+            break
+        try:
+            rotate(cur, rows, upload_folder)
+            last_id = rows[-1][0]
+            processed += len(rows)
+            _save_checkpoint(cur, name, last_id, processed)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        done_this_run += len(rows)
+        remaining = max(remaining - len(rows), 0)
+        if report:
+            elapsed = time.perf_counter() - started
+            rate = done_this_run / elapsed if elapsed else 0.0
+            report(job, processed, remaining, rate, remaining / rate if rate else None)
+        if pause:
+            time.sleep(pause)
+
+    cur.close()
+    return processed
+
+
+def rotate_all(connection, upload_folder, batch_size=200, pause=0.0, user_id=None, report=None):
+    """Run every rotation job in turn; returns {job: items processed}."""
+    return {
+        job: run_job(connection, job, upload_folder, batch_size, pause, user_id, report)
+        for job in JOBS
+    }
+
+
+def rotation_status(connection):
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT job, key_id, last_id, processed, completed, updated_at FROM key_rotation_state ORDER BY job"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    return [
+        {'job': r[0], 'key_id': r[1], 'last_id': r[2], 'processed': r[3],
+         'completed': bool(r[4]), 'updated_at': r[5]}
+        for r in rows
+    ]
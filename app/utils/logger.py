@@ -1,35 +1,158 @@
+import atexit
+import gzip
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp each record with request ID, user ID and elapsed time.
+
+    Runs on the request thread (the listener thread has no request context),
+    so it only copies a few attributes and never touches the database:
+    the user is read from flask-login's cache, not via ``current_user``.
+    """
+
+    def filter(self, record):
+        record.request_id = None
+        record.user_id = None
+        record.duration_ms = None
+        if has_request_context():
+            # One proxy lookup instead of one per attribute
+            ctx = g._get_current_object()
+            record.request_id = ctx.get('request_id')
+            start = ctx.get('request_start')
+            if start is not None:
+                record.duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            user = ctx.get('_login_user')
+            if user is not None and user.is_authenticated:
+                record.user_id = user.id
+        return True
+
+
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that defers message formatting to the listener thread.
+
+    The stock ``prepare`` copies the record and renders ``msg % args`` on the
+    calling thread so it can be pickled; our queue never leaves the process,
+    so a record whose args are all immutable scalars (the common case) is
+    enqueued as-is and formatted only by the handlers that consume it. Any
+    other argument could change before the listener gets to it, so those
+    messages are rendered here, as the stock handler does.
+    """
+
+    def prepare(self, record):
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(a, _IMMUTABLE_ARGS) for a in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ('request_id', 'user_id', 'duration_ms')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _gzip_rotator(source, dest):
+    # Called from doRollover, i.e. on the listener thread
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _start_request():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+
+def _tag_response(response):
+    request_id = getattr(g, 'request_id', None)
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+def shutdown_logger(app):
+    """Flush queued records and stop the listener thread. Safe to call twice."""
+    listener = app.extensions.pop('log_listener', None)
+    if listener is not None:
+        listener.stop()
+
 
 def setup_logger(app):
     # Create logs directory if it doesn't exist
     if not os.path.exists('logs'):
         os.makedirs('logs')
 
-    # Log format
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
-    # Rotating file handler — max 5MB per file, keep last 5 files
+    # Rotating file handler — max 5MB per file, keep last 5 gzipped files.
+    # Only the listener thread writes here, so rotation never blocks a request.
     file_handler = RotatingFileHandler(
         'logs/carecrypt.log',
         maxBytes=5 * 1024 * 1024,
         backupCount=5
     )
-    file_handler.setFormatter(formatter)
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    file_handler.setFormatter(JsonFormatter())
     file_handler.setLevel(logging.INFO)
 
     # Also keep logs visible in terminal
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(logging.Formatter(
+        '[%(asctime)s] %(levelname)s in %(module)s [%(request_id)s]: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    ))
     console_handler.setLevel(logging.WARNING)
 
-    # Attach to Flask's logger
+    # Request threads only enqueue; formatting and I/O happen on the listener
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    listener = QueueListener(log_queue, file_handler, console_handler,
+                             respect_handler_level=True)
+    listener.start()
+    # Drain whatever is still queued before the interpreter exits
+    app.extensions['log_listener'] = listener
+    atexit.register(shutdown_logger, app)
+
+    # Attach to Flask's logger. Flask's own stderr handler would write every
+    # record synchronously on the request thread, so it is replaced here.
     app.logger.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(console_handler)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+
+    app.before_request(_start_request)
+    app.after_request(_tag_response)
 
-    app.logger.info('CareCrypt logger initialized')
\ No newline at end of file
+    app.logger.info('CareCrypt logger initialized')
@@ -0,0 +1,218 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+from flask import g, request
+from app.utils import encryption
+
+# Opt-in per-request profiling. A profiled request runs under cProfile,
+# records every SQL statement issued through mysql.connection or the read
+# replica with its timing, counts decrypt/decrypt_file calls and bytes, and
+# writes a report to PROFILER_DIR. Streamed responses are reported once
+# their body has been sent. Unprofiled requests pay for one flag check.
+
+_tracing_cursors = {}
+
+
+class _TracingCursorMixin:
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            _record_sql(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, args)
+        finally:
+            _record_sql(query, time.perf_counter() - start, self.rowcount, batch=len(args or ()))
+
+
+def _tracing_cursor_class(base):
+    cls = _tracing_cursors.get(base)
+    if cls is None:
+        cls = type(f"Tracing{base.__name__}", (_TracingCursorMixin, base), {})
+        _tracing_cursors[base] = cls
+    return cls
+
+
+def trace_connection(connection):
+    """Trace every cursor this connection opens for the rest of the request.
+
+    Wraps ``cursor()`` on the connection itself rather than swapping its
+    default cursor class, so cursors opened with an explicit class (the
+    dashboard's SSCursor) are traced too.
+    """
+    if connection is None or getattr(connection, '_profiler_traced', False):
+        return
+    original = connection.cursor
+
+    def cursor(cursorclass=None):
+        return original(_tracing_cursor_class(cursorclass or connection.cursorclass))
+    connection.cursor = cursor
+    connection._profiler_traced = True
+
+
+def _record_sql(query, elapsed, rowcount, batch=None):
+    profile = g.get('_profile')
+    if profile is None:
+        return
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    entry = {'sql': ' '.join(query.split()), 'ms': round(elapsed * 1000, 3), 'rows': rowcount}
+    if batch is not None:
+        entry['batch'] = batch
+    profile['sql'].append(entry)
+
+
+def _record_decrypt(kind, size):
+    profile = g.get('_profile')
+    if profile is None:
+        return
+    counter = profile['decrypt'].setdefault(kind, {'calls': 0, 'bytes': 0})
+    counter['calls'] += 1
+    counter['bytes'] += size
+
+
+def _should_profile(app):
+    if app.config.get('PROFILER_ENABLED'):
+        return True
+    rate = app.config.get('PROFILER_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def _start_profile(app):
+    if not _should_profile(app) or request.path.startswith('/static'):
+        return
+
+    from app import mysql
+    trace_connection(mysql.connection)
+
+    profiler = cProfile.Profile()
+    g._profile = {
+        'profiler': profiler,
+        'start': time.perf_counter(),
+        'sql': [],
+        'decrypt': {},
+    }
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler (e.g. a debugger) already owns this thread
+        g._profile['profiler'] = None
+
+
+def _finish_profile(app, response):
+    profile = g.get('_profile')
+    if profile is None:
+        return response
+
+    user = g.get('_login_user')
+    summary = {
+        'request_id': g.get('request_id'),
+        'method': request.method,
+        # Never the query string: search terms are patient data
+        'path': request.path,
+        'status': response.status_code,
+        'user_id': user.id if user is not None and user.is_authenticated else None,
+    }
+    if response.is_streamed:
+        # The body (and its queries and decrypts) is produced after this
+        # hook returns, so report once the server has finished sending it
+        profile['streamed'] = True
+        response.call_on_close(lambda: _write_profile(app, profile, summary))
+    else:
+        g.pop('_profile', None)
+        _write_profile(app, profile, summary)
+    return response
+
+
+def _write_profile(app, profile, summary):
+    elapsed = time.perf_counter() - profile['start']
+    profiler = profile['profiler']
+    stats_text = ''
+    if profiler is not None:
+        profiler.disable()
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(40)
+        stats_text = buffer.getvalue()
+
+    summary.update({
+        'total_ms': round(elapsed * 1000, 2),
+        'sql_count': len(profile['sql']),
+        'sql_ms': round(sum(entry['ms'] for entry in profile['sql']), 2),
+        'decrypt': profile['decrypt'],
+        'sql': profile['sql'],
+    })
+
+    try:
+        write_report(app.config['PROFILER_DIR'], summary, stats_text)
+    except OSError as e:
+        app.logger.error("PROFILE WRITE FAILED | path=%s | error=%s", summary['path'], e)
+
+
+def _abandon_profile(exc=None):
+    # Covers requests that never reached after_request. A streamed response
+    # tears down before its body is generated, so its profile stays on g for
+    # the generator and is finished by the response's close callback
+    profile = g.get('_profile')
+    if profile is None or profile.get('streamed'):
+        return
+    g.pop('_profile', None)
+    if profile['profiler'] is not None:
+        profile['profiler'].disable()
+
+
+def write_report(directory, summary, stats_text):
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    # request_id may come from a client header, so keep it filename-safe
+    request_id = re.sub(r'[^A-Za-z0-9_-]', '', str(summary['request_id'] or ''))[:64]
+    name = f"{stamp}-{request_id or os.urandom(8).hex()}.txt"
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(summary, indent=2, default=str))
+        f.write('\n\n')
+        f.write(stats_text)
+    return name
+
+
+def list_reports(directory, limit=100):
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((n for n in os.listdir(directory) if n.endswith('.txt')), reverse=True)
+    return names[:limit]
+
+
+def read_report(directory, name):
+    if os.path.basename(name) != name or not name.endswith('.txt'):
+        return None
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def setup_profiler(app):
+    app.config.setdefault('PROFILER_ENABLED', False)
+    app.config.setdefault('PROFILER_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILER_DIR', 'profiles')
+
+    if not app.config['PROFILER_ENABLED'] and not app.config['PROFILER_SAMPLE_RATE']:
+        # Nothing is registered at all when profiling is off
+        return
+
+    encryption.set_decrypt_observer(_record_decrypt)
+    app.before_request(lambda: _start_profile(app))
+    app.after_request(lambda response: _finish_profile(app, response))
+    app.teardown_request(_abandon_profile)
+    app.logger.info(
+        "PROFILER ENABLED | always=%s | sample_rate=%s | dir=%s",
+        app.config['PROFILER_ENABLED'], app.config['PROFILER_SAMPLE_RATE'], app.config['PROFILER_DIR']
+    )
@@ -0,0 +1,231 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+# Server-side sessions in a local SQLite file. The cookie only carries a
+# signed session id; the record holds the session dict plus a last_active
+# timestamp. Activity is tracked in an in-memory index and written through
+# at most once per TOUCH_INTERVAL, so keep-alives neither rewrite the
+# cookie nor hit the database on every call.
+
+TOUCH_INTERVAL = 10
+SWEEP_INTERVAL = 60
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.initial_user_id = self.get('_user_id')
+        # Set on the fresh session that replaces one that timed out
+        self.expired_user_id = None
+
+
+class SQLiteSessionStore:
+    def __init__(self, path, lifetime):
+        self.path = path
+        self.lifetime = lifetime
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # sid -> [last_active in memory, last_active persisted]
+        self._index = {}
+        self._last_sweep = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " sid TEXT PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " last_active REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active)")
+        db.commit()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def load(self, sid):
+        """Return (data, last_active) or None if missing."""
+        row = self._db().execute(
+            "SELECT data, last_active FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            entry = self._index.get(sid)
+            if entry is None:
+                self._index[sid] = [row[1], row[1]]
+                last_active = row[1]
+            else:
+                # Another process may have persisted a newer touch
+                entry[1] = max(entry[1], row[1])
+                entry[0] = max(entry[0], row[1])
+                last_active = entry[0]
+        return row[0], last_active
+
+    def save(self, sid, data, now):
+        self._db().execute(
+            "INSERT INTO sessions (sid, data, last_active) VALUES (?, ?, ?) "
+            "ON CONFLICT(sid) DO UPDATE SET data = excluded.data, last_active = excluded.last_active",
+            (sid, data, now)
+        )
+        with self._lock:
+            self._index[sid] = [now, now]
+
+    def touch(self, sid, now=None):
+        """Record activity; persisted only if the stored value is stale."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._index.setdefault(sid, [now, 0.0])
+            entry[0] = max(entry[0], now)
+            if now - entry[1] < TOUCH_INTERVAL:
+                return
+            entry[1] = now
+        self._db().execute(
+            "UPDATE sessions SET last_active = ? WHERE sid = ? AND last_active < ?",
+            (now, sid, now)
+        )
+
+    def is_expired(self, last_active, now=None):
+        return (now or time.time()) - last_active > self.lifetime
+
+    def delete(self, sid):
+        self._db().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        with self._lock:
+            self._index.pop(sid, None)
+
+    def sweep(self, now=None):
+        """Delete every expired session in one statement; returns the count."""
+        now = now or time.time()
+        cutoff = now - self.lifetime
+        # Push pending in-memory touches first so active sessions survive
+        with self._lock:
+            pending = [(entry[0], sid) for sid, entry in self._index.items() if entry[0] > entry[1]]
+            for _, sid in pending:
+                self._index[sid][1] = self._index[sid][0]
+        db = self._db()
+        if pending:
+            db.executemany(
+                "UPDATE sessions SET last_active = ? WHERE sid = ? AND last_active < ?",
+                [(ts, sid, ts) for ts, sid in pending]
+            )
+        deleted = db.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,)).rowcount
+        with self._lock:
+            for sid in [sid for sid, entry in self._index.items() if entry[0] < cutoff]:
+                del self._index[sid]
+            self._last_sweep = now
+        return deleted
+
+    def maybe_sweep(self, now):
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(now)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+    salt = 'carecrypt-session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def _new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self._new_session()
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return self._new_session()
+
+        record = self.store.load(sid)
+        if record is None:
+            return self._new_session()
+        now = time.time()
+        data = self.serializer.loads(record[0])
+        if self.store.is_expired(record[1], now):
+            self.store.delete(sid)
+            fresh = self._new_session()
+            fresh.expired_user_id = data.get('_user_id')
+            return fresh
+        self.store.touch(sid, now)
+        return ServerSideSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        self.store.maybe_sweep(now)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # New id on login or logout so a pre-login id can never be reused
+        if not session.new and session.get('_user_id') != session.initial_user_id:
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+
+        if session.modified or session.new:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), now)
+        if session.new:
+            # A browser-session cookie: inactivity expiry is enforced here,
+            # so the cookie never needs re-issuing to extend it
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+            response.vary.add('Cookie')
+
+
+def touch_session():
+    """Refresh the current session's last-active time without writing a cookie."""
+    sid = getattr(session, 'sid', None)
+    if sid and not session.new:
+        session_store().touch(sid)
+
+
+def session_store():
+    from flask import current_app
+    return current_app.session_interface.store
+
+
+def setup_session_store(app):
+    store = SQLiteSessionStore(
+        app.config['SESSION_STORE_PATH'],
+        app.config['PERMANENT_SESSION_LIFETIME'].total_seconds()
+    )
+    app.session_interface = ServerSideSessionInterface(store)
@@ -0,0 +1,298 @@
+from datetime import datetime, timezone
+from flask import current_app
+from app.utils.encryption import encrypt, decrypt, blind_index
+from app.utils import storage
+
+# Per-user dashboard statistics, maintained incrementally by the write paths
+# so reading them never touches (or decrypts) the prescription history.
+# Every function takes the caller's cursor and leaves committing to the
+# caller, so counters change in the same transaction as the rows they count.
+# Write paths take lock_user_stats() before touching prescriptions; if a
+# decrement ever finds a counter too small, the user's counters are dropped
+# and rebuilt on next use rather than clamped at zero.
+
+TOP_MEDICATIONS = 5
+RECENT_MONTHS = 12
+
+
+def _month(created_at=None) -> str:
+    return (created_at or datetime.now(timezone.utc)).strftime('%Y-%m')
+
+
+def _ensure_row(cur, user_id):
+    """Create-or-lock the totals row; True if it was just created.
+
+    Either way the row ends up exclusively locked. INSERT IGNORE would only
+    take a shared lock on an existing row, and two writers upgrading shared
+    locks to FOR UPDATE deadlock. The no-op update leaves rowcount at 0 for
+    an existing row (flask_mysqldb does not set CLIENT.FOUND_ROWS).
+    """
+    cur.execute(
+        "INSERT INTO user_stats (user_id) VALUES (%s) "
+        "ON DUPLICATE KEY UPDATE user_id = user_id",
+        (user_id,)
+    )
+    return cur.rowcount == 1
+
+
+def _lock_totals(cur, user_id):
+    cur.execute("SELECT user_id FROM user_stats WHERE user_id = %s FOR UPDATE", (user_id,))
+    return cur.fetchone() is not None
+
+
+class _StatsDrift(Exception):
+    pass
+
+
+def _invalidate(cur, user_id, reason):
+    # A missing totals row means "rebuild before use", see lock_user_stats()
+    current_app.logger.warning("STATS DRIFT | user_id=%s | %s | rebuilding lazily", user_id, reason)
+    cur.execute("DELETE FROM user_monthly_stats WHERE user_id = %s", (user_id,))
+    cur.execute("DELETE FROM user_medication_stats WHERE user_id = %s", (user_id,))
+    cur.execute("DELETE FROM user_stats WHERE user_id = %s", (user_id,))
+
+
+def lock_user_stats(cur, user_id, upload_folder):
+    """Lock a user's statistics for the rest of the transaction.
+
+    Write paths call this before they read or change any prescription, so
+    they are serialised against each other and against rebuilds. Users with
+    no statistics yet (accounts that predate them, or counters dropped after
+    drift) are rebuilt from their rows here, before the write is applied.
+    """
+    if _ensure_row(cur, user_id):
+        _rebuild(cur, user_id, upload_folder)
+
+
+def _bump_totals(cur, user_id, prescriptions=0, images=0, storage_bytes=0):
+    deltas = {'prescription_count': prescriptions, 'image_count': images, 'storage_bytes': storage_bytes}
+    # Under the lock counters are exact, so one that would go negative has drifted
+    guards = [(column, -delta) for column, delta in deltas.items() if delta < 0]
+    cur.execute(
+        "UPDATE user_stats SET "
+        "prescription_count = prescription_count + %s, "
+        "image_count = image_count + %s, "
+        "storage_bytes = storage_bytes + %s "
+        "WHERE user_id = %s" + "".join(f" AND {column} >= %s" for column, _ in guards),
+        (prescriptions, images, storage_bytes, user_id, *[minimum for _, minimum in guards])
+    )
+    if guards and cur.rowcount == 0:
+        raise _StatsDrift('totals')
+
+
+def _bump_month(cur, user_id, month, delta):
+    if delta > 0:
+        cur.execute(
+            "INSERT INTO user_monthly_stats (user_id, month, prescription_count) "
+            "VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE prescription_count = prescription_count + VALUES(prescription_count)",
+            (user_id, month, delta)
+        )
+    else:
+        cur.execute(
+            "UPDATE user_monthly_stats SET prescription_count = prescription_count + %s "
+            "WHERE user_id = %s AND month = %s AND prescription_count >= %s",
+            (delta, user_id, month, -delta)
+        )
+        if cur.rowcount == 0:
+            raise _StatsDrift(f'month={month}')
+        cur.execute(
+            "DELETE FROM user_monthly_stats WHERE user_id = %s AND month = %s AND prescription_count = 0",
+            (user_id, month)
+        )
+
+
+def _bump_medication(cur, user_id, medication, delta):
+    if not medication:
+        return
+    med_index = blind_index(medication)
+    if delta > 0:
+        # The encrypted display name is only written when the counter is created
+        cur.execute(
+            "INSERT INTO user_medication_stats (user_id, med_index, med_name, prescription_count) "
+            "VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE prescription_count = prescription_count + VALUES(prescription_count)",
+            (user_id, med_index, encrypt(medication.strip()), delta)
+        )
+    else:
+        cur.execute(
+            "UPDATE user_medication_stats SET prescription_count = prescription_count + %s "
+            "WHERE user_id = %s AND med_index = %s AND prescription_count >= %s",
+            (delta, user_id, med_index, -delta)
+        )
+        if cur.rowcount == 0:
+            raise _StatsDrift('medication')
+        cur.execute(
+            "DELETE FROM user_medication_stats "
+            "WHERE user_id = %s AND med_index = %s AND prescription_count = 0",
+            (user_id, med_index)
+        )
+
+
+def _apply(cur, user_id, bumps):
+    """Run counter updates under the user's lock; drop the counters on drift."""
+    if not _lock_totals(cur, user_id):
+        # Already invalidated in this transaction; the next lock rebuilds
+        return
+    try:
+        bumps()
+    except _StatsDrift as e:
+        _invalidate(cur, user_id, e)
+
+
+def record_prescription_added(cur, user_id, medication, image_count=0, image_bytes=0, created_at=None):
+    def bumps():
+        _bump_totals(cur, user_id, prescriptions=1, images=image_count, storage_bytes=image_bytes)
+        _bump_month(cur, user_id, _month(created_at), 1)
+        _bump_medication(cur, user_id, medication, 1)
+    _apply(cur, user_id, bumps)
+
+
+def record_prescription_removed(cur, user_id, medication, created_at, image_count=0, image_bytes=0):
+    def bumps():
+        _bump_totals(cur, user_id, prescriptions=-1, images=-image_count, storage_bytes=-image_bytes)
+        _bump_month(cur, user_id, _month(created_at), -1)
+        _bump_medication(cur, user_id, medication, -1)
+    _apply(cur, user_id, bumps)
+
+
+def record_prescriptions_removed(cur, user_id, removed, image_count=0, image_bytes=0):
+    """Bulk form of record_prescription_removed.
+
+    ``removed`` is a list of (medication, created_at) pairs. Deltas are
+    grouped so each distinct month and medication is updated once.
+    """
+    if not removed:
+        return
+    months = {}
+    medications = {}
+    for medication, created_at in removed:
+        month = _month(created_at)
+        months[month] = months.get(month, 0) + 1
+        if medication:
+            entry = medications.setdefault(blind_index(medication), [medication, 0])
+            entry[1] += 1
+
+    def bumps():
+        _bump_totals(cur, user_id, prescriptions=-len(removed), images=-image_count, storage_bytes=-image_bytes)
+        for month, count in months.items():
+            _bump_month(cur, user_id, month, -count)
+        for medication, count in medications.values():
+            _bump_medication(cur, user_id, medication, -count)
+    _apply(cur, user_id, bumps)
+
+
+def record_medication_changed(cur, user_id, old_medication, new_medication):
+    if old_medication and new_medication and blind_index(old_medication) == blind_index(new_medication):
+        return
+
+    def bumps():
+        _bump_medication(cur, user_id, old_medication, -1)
+        _bump_medication(cur, user_id, new_medication, 1)
+    _apply(cur, user_id, bumps)
+
+
+def record_images_changed(cur, user_id, image_delta, bytes_delta):
+    if image_delta or bytes_delta:
+        _apply(cur, user_id, lambda: _bump_totals(cur, user_id, images=image_delta, storage_bytes=bytes_delta))
+
+
+def get_user_stats(cur, user_id):
+    """Read a user's statistics: a fixed number of indexed lookups.
+
+    Returns None if the user has no statistics yet; the caller then
+    rebuilds them on the primary with lock_user_stats().
+    """
+    cur.execute(
+        "SELECT prescription_count, image_count, storage_bytes FROM user_stats WHERE user_id = %s",
+        (user_id,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+
+    cur.execute(
+        "SELECT month, prescription_count FROM user_monthly_stats "
+        "WHERE user_id = %s ORDER BY month DESC LIMIT %s",
+        (user_id, RECENT_MONTHS)
+    )
+    months = [{'month': m[0], 'count': m[1]} for m in reversed(cur.fetchall())]
+
+    cur.execute(
+        "SELECT med_name, prescription_count FROM user_medication_stats "
+        "WHERE user_id = %s ORDER BY prescription_count DESC LIMIT %s",
+        (user_id, TOP_MEDICATIONS)
+    )
+    medications = [{'medication': decrypt(m[0]), 'count': m[1]} for m in cur.fetchall()]
+
+    return {
+        'prescription_count': int(row[0]),
+        'image_count': int(row[1]),
+        'storage_bytes': int(row[2]),
+        'per_month': months,
+        'top_medications': medications
+    }
+
+
+def rebuild_user_stats(cur, user_id, upload_folder):
+    """Recompute one user's statistics from scratch. Returns the prescription count."""
+    # Holding the totals row blocks concurrent incremental updates for this
+    # user until the rebuild commits, so none are lost or double-counted
+    _ensure_row(cur, user_id)
+    return _rebuild(cur, user_id, upload_folder)
+
+
+def _rebuild(cur, user_id, upload_folder):
+    # Locking reads see the latest committed rows even if this transaction
+    # already took a snapshot earlier in the request
+    cur.execute(
+        "SELECT p.id, p.medication, p.created_at, pi.filename "
+        "FROM prescriptions p LEFT JOIN prescription_images pi ON pi.prescription_id = p.id "
+        "WHERE p.user_id = %s LOCK IN SHARE MODE",
+        (user_id,)
+    )
+    rows = cur.fetchall()
+
+    # One row per image, or a single row for a prescription without images
+    seen = set()
+    image_count = 0
+    image_bytes = 0
+    months = {}
+    medications = {}
+    for prescription_id, medication, created_at, filename in rows:
+        if filename:
+            image_count += 1
+            image_bytes += storage.file_size(upload_folder, filename)
+        if prescription_id in seen:
+            continue
+        seen.add(prescription_id)
+        month = _month(created_at)
+        months[month] = months.get(month, 0) + 1
+        name = decrypt(medication)
+        if name:
+            med_index = blind_index(name)
+            if med_index in medications:
+                medications[med_index][1] += 1
+            else:
+                medications[med_index] = [name.strip(), 1]
+
+    cur.execute("DELETE FROM user_monthly_stats WHERE user_id = %s", (user_id,))
+    cur.execute("DELETE FROM user_medication_stats WHERE user_id = %s", (user_id,))
+    cur.execute(
+        "UPDATE user_stats SET prescription_count = %s, image_count = %s, storage_bytes = %s "
+        "WHERE user_id = %s",
+        (len(seen), image_count, image_bytes, user_id)
+    )
+    if months:
+        cur.executemany(
+            "INSERT INTO user_monthly_stats (user_id, month, prescription_count) VALUES (%s, %s, %s)",
+            [(user_id, month, count) for month, count in months.items()]
+        )
+    if medications:
+        cur.executemany(
+            "INSERT INTO user_medication_stats (user_id, med_index, med_name, prescription_count) "
+            "VALUES (%s, %s, %s, %s)",
+            [(user_id, med_index, encrypt(name), count)
+             for med_index, (name, count) in medications.items()]
+        )
+    return len(seen)
@@ -0,0 +1,266 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from itertools import islice
+
+# Encrypted uploads are fanned out as uploads/ab/cd/<id>.enc so no single
+# directory grows past a few hundred entries. Files written before sharding
+# live flat in uploads/ and keep resolving until the migration moves them.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+
+def new_filename() -> str:
+    return f"{uuid.uuid4().hex}.enc"
+
+
+def shard_dir(upload_folder: str, filename: str) -> str:
+    parts = [filename[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    return os.path.join(upload_folder, *parts)
+
+
+def shard_path(upload_folder: str, filename: str) -> str:
+    return os.path.join(shard_dir(upload_folder, filename), filename)
+
+
+def legacy_path(upload_folder: str, filename: str) -> str:
+    return os.path.join(upload_folder, filename)
+
+
+def _safe_name(filename: str) -> str:
+    # Stored names are generated by us, but never let one escape the folder
+    name = os.path.basename(filename)
+    if not name or name != filename:
+        raise ValueError(f"Invalid stored filename: {filename!r}")
+    return name
+
+
+def _lookup_paths(upload_folder: str, name: str):
+    # Files only ever move flat -> sharded, so checking the flat path first
+    # means a concurrent migration can't slip a file past both lookups
+    return legacy_path(upload_folder, name), shard_path(upload_folder, name)
+
+
+def resolve_path(upload_folder: str, filename: str):
+    """Return the on-disk path of a stored file, or None if it is missing."""
+    name = _safe_name(filename)
+    for path in _lookup_paths(upload_folder, name):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def file_size(upload_folder: str, filename: str) -> int:
+    path = resolve_path(upload_folder, filename)
+    try:
+        return os.path.getsize(path) if path else 0
+    except FileNotFoundError:
+        return 0
+
+
+def write_file(upload_folder: str, filename: str, data: bytes) -> str:
+    name = _safe_name(filename)
+    directory = shard_dir(upload_folder, name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def replace_file(upload_folder: str, filename: str, data: bytes) -> str:
+    """Atomically overwrite a stored file, moving it into the sharded layout.
+
+    Readers see either the old or the new contents, never a partial write.
+    """
+    name = _safe_name(filename)
+    directory = shard_dir(upload_folder, name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    try:
+        os.remove(legacy_path(upload_folder, name))
+    except FileNotFoundError:
+        pass
+    return path
+
+
+def read_file(upload_folder: str, filename: str):
+    """Read a stored file from either layout, or return None if it is missing."""
+    name = _safe_name(filename)
+    for path in _lookup_paths(upload_folder, name):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def remove_file(upload_folder: str, filename: str) -> bool:
+    name = _safe_name(filename)
+    removed = False
+    for path in _lookup_paths(upload_folder, name):
+        try:
+            os.remove(path)
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+_removal_queue = queue.SimpleQueue()
+_removal_worker = None
+_removal_lock = threading.Lock()
+
+
+def _removal_loop():
+    while True:
+        upload_folder, filenames = _removal_queue.get()
+        for filename in filenames:
+            try:
+                remove_file(upload_folder, filename)
+            except (OSError, ValueError):
+                # A leftover .enc file is harmless; never kill the worker
+                pass
+
+
+def remove_files_later(upload_folder: str, filenames):
+    """Queue files for removal on a background thread.
+
+    Used after a bulk delete has committed, so the request does not wait on
+    hundreds of unlinks. Files still queued when the process exits are left
+    on disk unreferenced; sweep_orphans() removes them.
+    """
+    global _removal_worker
+    filenames = list(filenames)
+    if not filenames:
+        return
+    with _removal_lock:
+        if _removal_worker is None or not _removal_worker.is_alive():
+            _removal_worker = threading.Thread(target=_removal_loop, name='upload-removal', daemon=True)
+            _removal_worker.start()
+    _removal_queue.put((upload_folder, filenames))
+
+
+def iter_stored_files(upload_folder: str):
+    """Yield (name, path) for every stored file in either layout, including
+    temp files a crashed replace_file() left behind."""
+    for root, dirs, files in os.walk(upload_folder):
+        depth = 0 if root == upload_folder else os.path.relpath(root, upload_folder).count(os.sep) + 1
+        if depth >= SHARD_DEPTH:
+            dirs[:] = []
+        if depth not in (0, SHARD_DEPTH):
+            continue
+        for name in files:
+            if name.endswith('.enc') or name.endswith('.tmp'):
+                yield name, os.path.join(root, name)
+
+
+def sweep_orphans(upload_folder: str, referenced, min_age: float = 3600, batch_size: int = 500,
+                  dry_run: bool = False, logger=None) -> int:
+    """Delete stored files that no prescription_images row refers to.
+
+    ``referenced(names)`` returns the subset of a batch of filenames that
+    still have a row. Files younger than ``min_age`` seconds are skipped:
+    uploads are written before their row commits, so a fresh file without
+    a row may just belong to an add that is still in flight.
+    """
+    cutoff = time.time() - min_age
+    removed = 0
+
+    def flush(batch):
+        nonlocal removed
+        known = referenced([name for name, _ in batch if name.endswith('.enc')])
+        for name, path in batch:
+            if name in known:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            if logger:
+                logger.info("UPLOAD ORPHAN %s | file=%s", 'FOUND' if dry_run else 'REMOVED', name)
+
+    batch = []
+    for name, path in iter_stored_files(upload_folder):
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        batch.append((name, path))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return removed
+
+
+def iter_legacy_files(upload_folder: str):
+    """Yield names of .enc files still stored in the flat layout."""
+    if not os.path.isdir(upload_folder):
+        return
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.enc'):
+                yield entry.name
+
+
+def migrate_legacy_files(upload_folder: str, batch_size: int = 500, pause: float = 0.0,
+                         limit: int = None, logger=None) -> int:
+    """Move flat uploads into the sharded layout, batch by batch.
+
+    Safe to run while the app is serving: each file is hard-linked into
+    place and then unlinked, and readers fall back across both layouts. Interrupting and
+    re-running simply picks up whatever is still flat.
+    """
+    moved = 0
+    while limit is None or moved < limit:
+        # Re-scan per batch rather than renaming under a live directory iterator
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        names = list(islice(iter_legacy_files(upload_folder), size))
+        if not names:
+            break
+        for name in names:
+            target_dir = shard_dir(upload_folder, name)
+            os.makedirs(target_dir, exist_ok=True)
+            source = legacy_path(upload_folder, name)
+            # link() never overwrites: if replace_file() has already written
+            # a newer sharded copy (e.g. re-encrypted by key rotation), the
+            # flat file is stale and is simply dropped
+            try:
+                os.link(source, os.path.join(target_dir, name))
+            except FileNotFoundError:
+                # Deleted by a request while we were scanning
+                continue
+            except FileExistsError:
+                pass
+            else:
+                moved += 1
+            try:
+                os.remove(source)
+            except FileNotFoundError:
+                pass
+        if logger:
+            logger.info("UPLOAD MIGRATION | moved=%s", moved)
+        if pause:
+            time.sleep(pause)
+    if logger:
+        logger.info("UPLOAD MIGRATION COMPLETE | moved=%s", moved)
+    return moved
@@ -0,0 +1,130 @@
+"""Dashboard time-to-first-byte and peak RSS: buffered vs streamed rendering.
+
+Needs the same environment as the app (MySQL reachable, FERNET_KEY set).
+Run from the repository root:
+
+    python benchmarks/bench_dashboard.py [--rows 5000]
+
+A benchmark user is created and topped up to ``--rows`` prescriptions on
+first run. Each mode is measured in a fresh subprocess so the peak RSS of
+one does not hide the other.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+BENCH_USERNAME = 'bench-dashboard'
+
+
+def rss_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def seed(rows):
+    from app import create_app, mysql
+    from app.utils.encryption import encrypt
+    from app.utils.hashing import hash_password
+    from app.utils import stats
+
+    app = create_app()
+    with app.app_context():
+        cur = mysql.connection.cursor()
+        cur.execute("SELECT id FROM users WHERE username = %s", (BENCH_USERNAME,))
+        row = cur.fetchone()
+        if row:
+            user_id = row[0]
+        else:
+            cur.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
+                (BENCH_USERNAME, f"{BENCH_USERNAME}@example.invalid", hash_password(os.urandom(16).hex()))
+            )
+            user_id = cur.lastrowid
+
+        cur.execute("SELECT COUNT(*) FROM prescriptions WHERE user_id = %s", (user_id,))
+        missing = rows - cur.fetchone()[0]
+        batch = []
+        for i in range(max(missing, 0)):
+            batch.append((user_id, encrypt(f"Patient {i}"), encrypt(f"Medication {i % 40}"),
+                          encrypt(f"{i % 3 + 1} tablet(s) daily"), encrypt("Take with food")))
+            if len(batch) == 1000 or i == missing - 1:
+                cur.executemany(
+                    "INSERT INTO prescriptions (user_id, patient_name, medication, dosage, notes) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    batch
+                )
+                batch = []
+        if missing > 0:
+            stats.rebuild_user_stats(cur, user_id, app.config['UPLOAD_FOLDER'])
+        mysql.connection.commit()
+        cur.close()
+    return user_id
+
+
+def measure(mode, user_id):
+    from app import create_app
+
+    app = create_app()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+    baseline_rss = rss_kb('VmRSS')
+    start = time.perf_counter()
+    response = client.get(f"/dashboard?stream={1 if mode == 'stream' else 0}", buffered=False)
+    ttfb = None
+    size = 0
+    for chunk in response.response:
+        if chunk and ttfb is None:
+            ttfb = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+
+    return {
+        'mode': mode,
+        'status': response.status_code,
+        'ttfb_ms': round((ttfb or total) * 1000, 1),
+        'total_ms': round(total * 1000, 1),
+        'html_kb': round(size / 1024, 1),
+        'baseline_rss_mb': round(baseline_rss / 1024, 1),
+        'peak_rss_mb': round(rss_kb('VmHWM') / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--measure', choices=['buffered', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument('--user-id', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.user_id)))
+        return
+
+    user_id = seed(args.rows)
+    print(f"{'mode':<9} {'status':>6} {'TTFB ms':>9} {'total ms':>9} {'HTML KB':>9} "
+          f"{'base RSS MB':>12} {'peak RSS MB':>12}")
+    for mode in ('buffered', 'stream'):
+        out = subprocess.run(
+            [sys.executable, __file__, '--measure', mode, '--user-id', str(user_id)],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['mode']:<9} {r['status']:>6} {r['ttfb_ms']:>9} {r['total_ms']:>9} {r['html_kb']:>9} "
+              f"{r['baseline_rss_mb']:>12} {r['peak_rss_mb']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Per-request logging cost: synchronous handlers vs the queue pipeline.
+
+Run from the repository root:
+
+    python benchmarks/bench_logging.py [--requests 2000] [--rounds 5]
+
+Each mode serves the same route through Flask's test client, once with
+logging calls and once without. Overhead is measured against a bare app
+with no logging setup at all, so fixed per-request costs a pipeline adds
+(such as the queued setup's request-id hooks) count towards it. The
+absolute time of each mode's quiet route is shown as well.
+Log files are written to a temporary directory and stderr is discarded
+while timing, so console output is measured against /dev/null.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask, current_app, request  # noqa: E402
+from app.utils.logger import setup_logger, shutdown_logger  # noqa: E402
+
+
+def setup_sync_logger(app):
+    # The handler layout setup_logger used before the queue pipeline
+    formatter = logging.Formatter(
+        '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    file_handler = RotatingFileHandler('logs/carecrypt.log', maxBytes=5 * 1024 * 1024, backupCount=5)
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(logging.WARNING)
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.addHandler(console_handler)
+
+
+def build_app(name, setup):
+    app = Flask(name)
+    setup(app)
+
+    @app.route('/quiet')
+    def quiet():
+        return 'ok'
+
+    @app.route('/sync')
+    def noisy_sync():
+        for i in range(3):
+            current_app.logger.info(
+                f"PRESCRIPTION ADDED | user_id={i} | patient=Jane Doe | ip={request.remote_addr}"
+            )
+        return 'ok'
+
+    @app.route('/queued')
+    def noisy_queued():
+        for i in range(3):
+            current_app.logger.info(
+                "PRESCRIPTION ADDED | user_id=%s | patient=%s | ip=%s",
+                i, 'Jane Doe', request.remote_addr
+            )
+        return 'ok'
+
+    return app
+
+
+def time_route(app, path, n, rounds):
+    """Return (mean, p99) request latency in microseconds, best of ``rounds``."""
+    client = app.test_client()
+    for _ in range(200):
+        client.get(path)
+    best = None
+    for _ in range(rounds):
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            client.get(path)
+            samples.append((time.perf_counter() - start) * 1e6)
+        samples.sort()
+        result = (statistics.fmean(samples), samples[int(len(samples) * 0.99)])
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Best of N rounds is reported to damp scheduler noise.')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='carecrypt-bench-'))
+    os.makedirs('logs', exist_ok=True)
+
+    bare_app = build_app('bench_bare', lambda app: None)
+    sync_app = build_app('bench_sync', setup_sync_logger)
+    queued_app = build_app('bench_queued', setup_logger)
+
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+
+    bare, bare_p99 = time_route(bare_app, '/quiet', args.requests, args.rounds)
+    print(f"{'mode':<8} {'quiet us/req':>13} {'logging us/req':>15} "
+          f"{'overhead us':>12} {'p99 us':>9}")
+    print(f"{'bare':<8} {bare:>13.1f} {'-':>15} {'-':>12} {bare_p99:>9.1f}")
+    for label, app, path in (('sync', sync_app, '/sync'), ('queued', queued_app, '/queued')):
+        quiet, _ = time_route(app, '/quiet', args.requests, args.rounds)
+        noisy, p99 = time_route(app, path, args.requests, args.rounds)
+        print(f"{label:<8} {quiet:>13.1f} {noisy:>15.1f} {noisy - bare:>12.1f} {p99:>9.1f}")
+
+    # Queued records are written after the response; report the drain too
+    start = time.perf_counter()
+    shutdown_logger(queued_app)
+    sys.stderr = stderr
+    print(f"queued listener drained backlog in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Dashboard latency while a key rotation runs in the background.
+
+Needs the same environment as the app (MySQL reachable, FERNET_KEY or
+FERNET_KEYS set). Run from the repository root:
+
+    python benchmarks/bench_rotation.py [--rows 5000] [--batch-size 200] [--pause 0.05]
+
+Only the benchmark user's data is rotated (see bench_dashboard.py for how
+it is seeded). A throwaway key is made primary, dashboard latency is
+sampled first with the rotation idle and then while it runs, and finally
+the data is rotated back to the original primary key.
+
+A two-key ring needs BLIND_INDEX_KEY. If it is unset, the benchmark pins it
+to the current (oldest) key, so existing medication counters keep their
+index for the whole run.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cryptography.fernet import Fernet  # noqa: E402
+from bench_dashboard import seed  # noqa: E402
+
+
+def sample_dashboard(client, stop=None, count=None):
+    latencies = []
+    while (count is not None and len(latencies) < count) or (stop is not None and not stop.is_set()):
+        start = time.perf_counter()
+        response = client.get('/dashboard?stream=0')
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def summarise(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f"{label:<18} {len(latencies):>5} {statistics.median(latencies):>9.1f} {p95:>9.1f} {latencies[-1]:>9.1f}")
+
+
+def rotate(app, user_id, batch_size, pause, progress):
+    from app import mysql
+    from app.utils import key_rotation
+
+    with app.app_context():
+        key_rotation.rotate_all(
+            mysql.connection, app.config['UPLOAD_FOLDER'],
+            batch_size=batch_size, pause=pause, user_id=user_id,
+            report=lambda job, processed, remaining, rate, eta: progress.append((job, rate))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--samples', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.05)
+    args = parser.parse_args()
+
+    from app.utils.encryption import load_keys
+    original_keys = load_keys()
+    user_id = seed(args.rows)
+
+    from app import create_app
+    app = create_app()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+    # Must be set before the ring grows to two keys (see blind_index_key)
+    os.environ.setdefault('BLIND_INDEX_KEY', original_keys[-1])
+    bench_key = Fernet.generate_key().decode()
+    os.environ['FERNET_KEYS'] = ','.join([bench_key, *original_keys])
+
+    print(f"{'phase':<18} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    summarise('idle', sample_dashboard(client, count=args.samples))
+
+    progress = []
+    stop = threading.Event()
+    started = time.perf_counter()
+
+    def run_rotation():
+        try:
+            rotate(app, user_id, args.batch_size, args.pause, progress)
+        finally:
+            stop.set()
+
+    worker = threading.Thread(target=run_rotation)
+    worker.start()
+    during = sample_dashboard(client, stop=stop)
+    worker.join()
+    elapsed = time.perf_counter() - started
+    summarise('during rotation', during)
+
+    rates = [rate for job, rate in progress if job == 'prescriptions']
+    print(f"rotation took {elapsed:.1f}s; prescriptions throughput "
+          f"{rates[-1] if rates else 0:.0f} rows/s")
+
+    # Put the benchmark user's data back under the original primary key
+    os.environ['FERNET_KEYS'] = ','.join([*original_keys, bench_key])
+    rotate(app, user_id, args.batch_size, 0, [])
+
+
+if __name__ == '__main__':
+    main()
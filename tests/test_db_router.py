@@ -0,0 +1,192 @@
+import time
+
+import pytest
+from flask import Flask, g, session
+
+from app.utils.db_router import LAST_WRITE_KEY, ReplicaRouter, mark_write, read_db, setup_db_router
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, args=None):
+        self.connection.queries.append(query)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stand-in connection that records the queries sent to it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = []
+        self.closed = False
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Replica:
+    """Replica factory whose connection, lag and availability tests control."""
+
+    def __init__(self):
+        self.lag = 0
+        self.up = True
+        self.probe_fails = False
+        self.connects = 0
+        self.probes = 0
+        self.connections = []
+
+    def connect(self):
+        self.connects += 1
+        if not self.up:
+            raise OSError("replica unreachable")
+        connection = FakeConnection('replica')
+        self.connections.append(connection)
+        return connection
+
+    def probe(self, connection):
+        self.probes += 1
+        if self.probe_fails:
+            raise OSError("lost connection during SHOW REPLICA STATUS")
+        return self.lag
+
+
+@pytest.fixture
+def primary():
+    return FakeConnection('primary')
+
+
+@pytest.fixture
+def replica():
+    return Replica()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def app(primary, replica, clock):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config.update(REPLICA_STICKY_SECONDS=5, REPLICA_MAX_LAG_SECONDS=2,
+                      REPLICA_HEALTH_INTERVAL=5, REPLICA_RETRY_SECONDS=30)
+    setup_db_router(app, primary=lambda: primary, connect_replica=replica.connect)
+    router = app.extensions['db_router']
+    router.lag_probe = replica.probe
+    router.clock = clock
+    return app
+
+
+def run_read(app, last_write=None):
+    """Issue one read in a fresh request and return where it went."""
+    with app.test_request_context():
+        if last_write is not None:
+            session[LAST_WRITE_KEY] = last_write
+        read_db().cursor().execute("SELECT 1")
+        return read_db().name
+
+
+def test_reads_go_to_replica_by_default(app, primary, replica):
+    assert run_read(app) == 'replica'
+    assert replica.connections[0].queries == ["SELECT 1"]
+    assert primary.queries == []
+
+
+def test_replica_connection_closed_at_teardown(app, replica):
+    run_read(app)
+    assert replica.connections[0].closed
+
+
+def test_reads_stick_to_primary_after_a_write(app, primary):
+    with app.test_request_context():
+        mark_write()
+        read_db().cursor().execute("SELECT 1")
+    assert primary.queries == ["SELECT 1"]
+
+
+def test_sticky_window_expires(app):
+    assert run_read(app, last_write=time.time() - 1) == 'primary'
+    assert run_read(app, last_write=time.time() - 10) == 'replica'
+
+
+def test_falls_back_while_replica_lags(app, replica, clock):
+    replica.lag = 10
+    assert run_read(app) == 'primary'
+    replica.lag = 0
+    clock.now += 5
+    assert run_read(app) == 'replica'
+
+
+def test_falls_back_when_replication_stopped(app, replica):
+    replica.lag = None
+    assert run_read(app) == 'primary'
+
+
+def test_health_check_is_cached_between_intervals(app, replica, clock):
+    run_read(app)
+    run_read(app)
+    assert replica.probes == 1
+    clock.now += 5
+    run_read(app)
+    assert replica.probes == 2
+
+
+def test_falls_back_on_connect_failure_and_retries_later(app, replica, clock):
+    replica.up = False
+    assert run_read(app) == 'primary'
+    assert replica.connects == 1
+
+    # Within the retry window the replica is not even attempted
+    replica.up = True
+    clock.now += 29
+    assert run_read(app) == 'primary'
+    assert replica.connects == 1
+
+    clock.now += 1
+    assert run_read(app) == 'replica'
+    assert replica.connects == 2
+
+
+def test_falls_back_when_health_check_fails(app, replica, clock):
+    replica.probe_fails = True
+    assert run_read(app) == 'primary'
+    replica.probe_fails = False
+    clock.now += 30
+    assert run_read(app) == 'replica'
+
+
+def test_outside_a_request_reads_use_primary(app, primary):
+    with app.app_context():
+        assert read_db() is primary
+        assert g.get('_replica_db') is None
+
+
+def test_no_replica_configured_means_no_router():
+    app = Flask(__name__)
+    setup_db_router(app, primary=lambda: None)
+    assert 'db_router' not in app.extensions
+
+
+def test_router_without_replica_factory_uses_primary(primary):
+    router = ReplicaRouter(lambda: primary)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    with app.test_request_context():
+        assert router.read_connection() is primary